@@ -1,5 +1,6 @@
 import streamlit as st
 import numpy as np
+from numpy.polynomial import Polynomial
 import pandas as pd
 import plotly.graph_objects as go
 from dateutil.relativedelta import relativedelta
@@ -80,6 +81,91 @@ with st.sidebar:
     # =============================================
     # BOND CALCULATION FUNCTIONS
     # =============================================
+    # Coupon payments per year for each frequency label
+    FREQ_MAP = {"Annual": 1, "Semi-Annual": 2, "Quarterly": 4, "Monthly": 12}
+
+    # Years of slack when counting coupon periods, so maturities derived from
+    # dates (days / 365.25) that fall a day or two short of a period still count it
+    MATURITY_TOLERANCE = 2 / 365.25
+
+    # Frequency options: Bond Pricing offers all of FREQ_MAP, the Risk Metrics
+    # and Bond Comparison inputs stop at Quarterly
+    PRICING_COUPON_FREQS = tuple(FREQ_MAP)
+    COUPON_FREQS = PRICING_COUPON_FREQS[:PRICING_COUPON_FREQS.index("Quarterly") + 1]
+
+    # Dollar amounts in metrics, e.g. $1,234.56
+    format_currency = "${:,.2f}".format
+
+    # VaR confidence levels (%) and their one-sided normal quantiles,
+    # indexed by selectbox position
+    CONFIDENCE_LEVELS = (90, 95, 99, 99.5, 99.9)
+    Z_SCORES = (1.282, 1.645, 2.326, 2.576, 3.090)
+
+    # Stress scenarios; the historical ones (all but the last) carry a
+    # yield shock (bps) and recovery time at the same position
+    STRESS_SCENARIOS = ("2020 COVID Crisis", "2008 Lehman Shock", "1994 Bond Massacre", "Custom Shock")
+    SCENARIO_SHOCKS = (75, 125, 200)
+    SCENARIO_RECOVERY = ("3 months", "12 months", "6 months")
+
+    # S&P rating scales: full notched scale for the Credit Risk page, letter
+    # grades for the Bond Comparison Tool
+    CREDIT_RATINGS = ("AAA", "AA+", "AA", "AA-", "A+", "A", "A-",
+                      "BBB+", "BBB", "BBB-", "BB+", "BB", "BB-", "B+", "B", "B-",
+                      "CCC+", "CCC", "CCC-", "CC", "C", "D")
+    RATINGS = ("AAA", "AA", "A", "BBB", "BB", "B", "CCC")
+
+    # Bond Comparison Tool scenarios: yield shift in % applied to every bond
+    COMPARISON_SCENARIOS = {"Rates +100bps": 1.0, "Rates -50bps": -0.5, "Credit Spread +50bps": 0.5}
+    COMPARISON_SCENARIO_NAMES = tuple(COMPARISON_SCENARIOS)
+
+    # Bond Comparison Tool holdings: one column per field, one row per bond
+    COMPARISON_COLUMNS = ['name', 'purchase_price', 'face_value', 'coupon_rate', 'coupon_freq',
+                          'purchase_date', 'maturity_date', 'current_date',
+                          'credit_spread', 'rating', 'sector', 'ytm', 'duration']
+    # Subset shown in the comparison table
+    COMPARISON_DISPLAY_COLUMNS = ['name', 'purchase_price', 'face_value', 'coupon_rate',
+                                  'coupon_freq', 'ytm', 'duration']
+
+    def vanilla_cash_flows(face_value, periodic_coupon, periods, n, **kwargs):
+        """Regular coupons with principal repaid in the final period."""
+        cash_flows = np.full(periods, face_value * periodic_coupon)
+        cash_flows[-1] += face_value
+        return cash_flows
+
+    def zero_coupon_cash_flows(face_value, periodic_coupon, periods, n, **kwargs):
+        """Only the final principal payment."""
+        cash_flows = np.zeros(periods)
+        cash_flows[-1] = face_value
+        return cash_flows
+
+    def callable_cash_flows(face_value, periodic_coupon, periods, n, **kwargs):
+        """Coupons until the call date, then the call price; vanilla if not called."""
+        call_period = int((kwargs['call_date'].year - kwargs['valuation_date'].year) * n)
+        if call_period >= periods:
+            # Not called - treat as vanilla
+            return vanilla_cash_flows(face_value, periodic_coupon, periods, n)
+        # Zero after call date
+        cash_flows = np.zeros(periods)
+        # Coupons until call date
+        cash_flows[:call_period] = face_value * periodic_coupon
+        # Call price at call date
+        cash_flows[call_period] = kwargs['call_price'] / 100 * face_value
+        return cash_flows
+
+    def other_cash_flows(face_value, periodic_coupon, periods, n, **kwargs):
+        """Placeholder for structures without a cash flow model yet."""
+        # Similar logic for other bond types would go here...
+        # (Putable, Step-Up, Step-Down, Fixed-to-Floating, etc.)
+        return np.zeros(periods)
+
+    # Cash flow builder for each supported bond type
+    CASH_FLOW_BUILDERS = {
+        "Vanilla Fixed Rate": vanilla_cash_flows,
+        "Zero Coupon": zero_coupon_cash_flows,
+        "Callable Bond": callable_cash_flows
+    }
+
+    @st.cache_data(max_entries=512)
     def calculate_bond_metrics(face_value, coupon_rate, ytm, years_to_maturity, 
                              coupon_freq, bond_type, **kwargs):
         """
@@ -93,77 +179,241 @@ with st.sidebar:
         - coupon_freq: Coupon payment frequency
         - bond_type: Type of bond structure
         
-        Returns dictionary with all calculated metrics
+        Returns dictionary with all calculated metrics. Results are cached
+        on the input parameters, so reruns with unchanged inputs skip pricing.
         """
         # Convert annual rates to decimal
         coupon_rate = coupon_rate / 100
         ytm = ytm / 100
         
         # Determine payment frequency
-        freq_map = {"Annual": 1, "Semi-Annual": 2, "Quarterly": 4, "Monthly": 12}
-        n = freq_map[coupon_freq]
-        periods = int(years_to_maturity * n)
+        n = FREQ_MAP[coupon_freq]
+        # Whole periods to maturity, allowing MATURITY_TOLERANCE of day-count
+        # noise: 3652 days / 365.25 = 9.9986 years still counts as 10 years
+        periods = int(np.floor((years_to_maturity + MATURITY_TOLERANCE) * n))
+        period_grid = np.arange(1, periods+1)
         
         # Calculate periodic rates
         periodic_coupon = coupon_rate / n
         periodic_ytm = ytm / n
         
-        # Initialize cash flows array
-        cash_flows = np.zeros(periods)
-        
-        # Handle different bond types
-        if bond_type == "Vanilla Fixed Rate":
-            # Regular coupon payments
-            cash_flows[:-1] = face_value * periodic_coupon
-            # Final payment includes principal
-            cash_flows[-1] = face_value * (1 + periodic_coupon)
-            
-        elif bond_type == "Zero Coupon":
-            # Only final payment
-            cash_flows[-1] = face_value
-            
-        elif bond_type == "Callable Bond":
-            call_period = int((kwargs['call_date'].year - datetime.today().year) * n)
-            if call_period < periods:
-                # Coupons until call date
-                cash_flows[:call_period] = face_value * periodic_coupon
-                # Call price at call date
-                cash_flows[call_period] = kwargs['call_price'] / 100 * face_value
-                # Zero after call date
-                cash_flows[call_period+1:] = 0
-            else:
-                # Not called - treat as vanilla
-                cash_flows[:-1] = face_value * periodic_coupon
-                cash_flows[-1] = face_value * (1 + periodic_coupon)
-                
-        # Similar logic for other bond types would go here...
-        # (Putable, Step-Up, Step-Down, Fixed-to-Floating, etc.)
+        # Build cash flows for the selected bond structure
+        cash_flows = CASH_FLOW_BUILDERS.get(bond_type, other_cash_flows)(
+            face_value, periodic_coupon, periods, n, **kwargs
+        )
         
         # Calculate bond price as present value of cash flows
-        discount_factors = 1 / (1 + periodic_ytm) ** np.arange(1, periods+1)
-        price = np.sum(cash_flows * discount_factors)
+        # (discount factors built by recurrence: d, d^2, d^3, ...)
+        discount = 1 / (1 + periodic_ytm)
+        discount_factors = np.cumprod(np.full(periods, discount))
+        pv_cash_flows = cash_flows * discount_factors
+        price = np.sum(pv_cash_flows)
         
         # Calculate Macaulay Duration
-        times = np.arange(1, periods+1) / n
-        pv_cash_flows = cash_flows * discount_factors
-        mac_duration = np.sum(times * pv_cash_flows) / price
+        times = period_grid / n
+        mac_duration = np.dot(times, pv_cash_flows) / price
         
         # Calculate Modified Duration
-        mod_duration = mac_duration / (1 + periodic_ytm)
+        mod_duration = mac_duration * discount
         
         # Calculate Convexity
-        convexity = np.sum(times * (times + 1/n) * pv_cash_flows / ((1 + periodic_ytm)**2)) / price
+        convexity = np.dot(times * (times + 1/n), pv_cash_flows) * (discount * discount) / price
         
         return {
             "Price": price,
             "Macaulay Duration": mac_duration,
             "Modified Duration": mod_duration,
+            "Dollar Duration": price * mod_duration,
             "Convexity": convexity,
             "Yield to Maturity": ytm,
             "Cash Flows": cash_flows,
-            "Discount Factors": discount_factors
+            "Discount Factors": discount_factors,
+            "Present Values": pv_cash_flows
+        }
+
+    def batch_bond_metrics(face_value, coupon_rate, ytm, years_to_maturity,
+                           coupon_freq="Semi-Annual"):
+        """
+        Vanilla fixed rate metrics for many bonds in one vectorized pass.
+        
+        Parameters (equal-length arrays, one entry per bond):
+        - face_value: Nominal value of each bond
+        - coupon_rate: Annual coupon rate (%)
+        - ytm: Yield to maturity (%)
+        - years_to_maturity: Time to maturity in years
+        - coupon_freq: Coupon payment frequency shared by all bonds
+        
+        All bonds are laid out on one padded period grid, with periods past
+        each bond's maturity masked out, so the results match
+        calculate_bond_metrics bond by bond.
+        
+        Returns dictionary of per-bond arrays keyed like calculate_bond_metrics
+        """
+        face_value = np.asarray(face_value, dtype=float)
+        coupon_rate = np.asarray(coupon_rate, dtype=float) / 100
+        ytm = np.asarray(ytm, dtype=float) / 100
+        
+        n = FREQ_MAP[coupon_freq]
+        periods = np.floor((np.asarray(years_to_maturity, dtype=float) + MATURITY_TOLERANCE) * n).astype(int)
+        period_grid = np.arange(1, periods.max(initial=0) + 1)
+        
+        # Coupons up to each bond's maturity, principal in its final period
+        cash_flows = (period_grid <= periods[:, None]) * (face_value * coupon_rate / n)[:, None]
+        cash_flows += (period_grid == periods[:, None]) * face_value[:, None]
+        
+        # Discount factors by recurrence along each bond's row
+        discount = 1 / (1 + ytm / n)
+        discount_factors = np.cumprod(
+            np.broadcast_to(discount[:, None], cash_flows.shape), axis=1
+        )
+        pv_cash_flows = cash_flows * discount_factors
+        price = pv_cash_flows.sum(axis=1)
+        
+        times = period_grid / n
+        mac_duration = pv_cash_flows @ times / price
+        mod_duration = mac_duration * discount
+        convexity = pv_cash_flows @ (times * (times + 1/n)) * (discount * discount) / price
+        
+        return {
+            "Price": price,
+            "Macaulay Duration": mac_duration,
+            "Modified Duration": mod_duration,
+            "Dollar Duration": price * mod_duration,
+            "Convexity": convexity,
+            "Yield to Maturity": ytm
         }
 
+    @st.cache_data(max_entries=64)
+    def price_portfolio(holdings, coupon_freq="Semi-Annual"):
+        """
+        Return the holdings DataFrame with per-holding metric columns attached.
+        
+        Cached on the holdings, so reruns that leave the portfolio unchanged
+        (e.g. moving the yield shift slider) reuse the priced DataFrame.
+        """
+        return holdings.assign(**batch_bond_metrics(
+            face_value=holdings['face_value'].to_numpy(),
+            coupon_rate=holdings['coupon_rate'].to_numpy(),
+            ytm=holdings['ytm'].to_numpy(),
+            years_to_maturity=holdings['maturity'].to_numpy(),
+            coupon_freq=coupon_freq
+        ))
+
+    def nelson_siegel(t, b0, b1, b2, tau):
+        """
+        Nelson-Siegel yield curve evaluated at maturities t (float array).
+        
+        Parameters:
+        - b0, b1, b2: Level, slope and curvature factors
+        - tau: Decay rate
+        """
+        u = t/tau
+        decay = np.exp(-u)
+        # Shared loading (1-e^-u)/u, which tends to 1 as t -> 0
+        loading = np.divide(1-decay, u, out=np.ones_like(u), where=u != 0)
+        return b0 + b1*loading + b2*(loading-decay)
+
+    def implied_forward_rate(y_start, start_year, y_end, end_year):
+        """Annual forward rate between start_year and end_year implied by spot yields."""
+        return (((1+y_end)**end_year)/((1+y_start)**start_year))**(1/(end_year-start_year)) - 1
+
+    @st.cache_data(max_entries=128)
+    def calculate_credit_var(cds_spread, recovery_rate, confidence_idx):
+        """
+        Simplified 1Y Credit VaR (%) from the CDS-implied risk-neutral PD.
+        
+        confidence_idx indexes CONFIDENCE_LEVELS / Z_SCORES.
+        """
+        risk_neutral_pd = (cds_spread/10000)/(1-recovery_rate/100)
+        return risk_neutral_pd * Z_SCORES[confidence_idx] * 100
+
+    def creditrisk_unexpected_loss(exposure, probability_default, default_volatility):
+        """
+        CreditRisk+ unexpected loss for one obligor or, elementwise, for NumPy
+        arrays of exposures / PDs (%) / default rate volatilities (%).
+        """
+        pd_rate = probability_default/100
+        return exposure * np.sqrt(pd_rate*(1-pd_rate)*(default_volatility/100)**2)
+
+    @st.cache_data
+    def rating_transition_matrix():
+        """One-year transition probabilities and 5Y spreads for a single-A issuer."""
+        return pd.DataFrame({
+            'Rating': ['AAA', 'AA', 'A', 'BBB', 'BB', 'B', 'CCC', 'Default'],
+            '1Y Transition (%)': [0.09, 2.27, 91.05, 5.52, 0.74, 0.26, 0.01, 0.06],
+            '5Y Spread (bps)': [15, 30, 50, 120, 300, 550, 1000, 5000]
+        })
+
+    @st.cache_data
+    def default_probability_figure():
+        """Bar chart of historical default probabilities by rating."""
+        ratings = ['AAA', 'AA', 'A', 'BBB', 'BB', 'B', 'CCC']
+        default_probs = [0.03, 0.06, 0.15, 0.30, 1.20, 5.00, 20.00]
+        return px.bar(x=ratings, y=default_probs, 
+                      labels={'x':'Credit Rating', 'y':'Historical PD (%)'},
+                      title='Historical Default Probabilities by Rating')
+
+    @st.cache_data(max_entries=64)
+    def fit_polynomial_curve(maturities, yields, degree):
+        """
+        Least-squares polynomial fit of the yield curve.
+        
+        Polynomial.fit maps the maturities onto [-1, 1] before fitting, which
+        keeps higher degree fits over 0.25-30Y well conditioned. Cached on the
+        curve points and degree.
+        """
+        return Polynomial.fit(maturities, yields, degree)
+
+    @st.cache_data(max_entries=64)
+    def calculate_ytm_duration(bonds):
+        """
+        Simplified yield to maturity and duration used by the Bond Comparison Tool.
+        
+        Vectorized over a DataFrame with purchase_price, face_value, coupon_rate,
+        maturity_date and current_date columns. Returns (ytm, duration)
+        arrays; both are 0 for bonds with no remaining life or no purchase price.
+        """
+        # Calculate years to maturity from current date
+        years_to_maturity = (pd.to_datetime(bonds['maturity_date']) -
+                             pd.to_datetime(bonds['current_date'])).dt.days.to_numpy() / 365.25
+        purchase_price = bonds['purchase_price'].to_numpy(dtype=float)
+        face_value = bonds['face_value'].to_numpy(dtype=float)
+        
+        # Coupon income to maturity: periodic coupon x periods, i.e. the annual
+        # coupon x years for any payment frequency
+        annual_coupon = face_value * (bonds['coupon_rate'].to_numpy(dtype=float)/100)
+        
+        # Simplified YTM calculation (approximation); matured or unpriced bonds get 0
+        total_coupons = annual_coupon * years_to_maturity
+        total_gain = face_value - purchase_price
+        priced = (years_to_maturity > 0) & (purchase_price > 0)
+        ytm = np.divide(total_coupons + total_gain, years_to_maturity * purchase_price,
+                        out=np.zeros_like(years_to_maturity), where=priced)
+        
+        # Simplified duration calculation
+        duration = np.divide(years_to_maturity, 1 + ytm,
+                             out=np.zeros_like(years_to_maturity), where=priced & (ytm > -1))
+        return ytm, duration
+
+    @st.cache_data(max_entries=32)
+    def purchase_price_figure(bonds):
+        """Bar chart of purchase prices in the Bond Comparison Tool."""
+        return px.bar(bonds, x='name', y='purchase_price', title="Purchase Price Comparison")
+
+    @st.cache_data(max_entries=32)
+    def risk_return_figure(bonds):
+        """Duration vs. YTM scatter sized by credit spread and coloured by rating."""
+        return px.scatter(bonds, x='duration', y='ytm', color='rating',
+                          size='credit_spread', hover_name='name',
+                          title="Risk-Return Profile",
+                          labels={'duration': 'Duration (years)', 'ytm': 'Yield to Maturity'})
+
+    @st.cache_data(max_entries=32)
+    def scenario_figure(bonds, scenario):
+        """Bar chart of per-bond price changes under a comparison scenario."""
+        return px.bar(bonds, x='name', y='price_change', color='rating',
+                      title=f"Price Change in {scenario} Scenario (%)")
+
 # =============================================
 # MAIN PAGE CONTENT
 # =============================================
@@ -226,7 +476,7 @@ if analysis_type == "Bond Pricing & Analytics":
             # Coupon frequency
             coupon_freq = st.selectbox(
                 "Coupon Frequency:",
-                ["Annual", "Semi-Annual", "Quarterly", "Monthly"],
+                PRICING_COUPON_FREQS,
                 index=1,
                 help="How often coupon payments are made per year."
             )
@@ -355,7 +605,9 @@ if analysis_type == "Bond Pricing & Analytics":
         # Prepare arguments based on bond type
         kwargs = {}
         if bond_type == "Callable Bond":
-            kwargs = {'call_date': call_date, 'call_price': call_price}
+            # Valuation date is passed in so it is part of the pricing cache key
+            kwargs = {'call_date': call_date, 'call_price': call_price,
+                      'valuation_date': datetime.today().date()}
         elif bond_type == "Putable Bond":
             kwargs = {'put_date': put_date, 'put_price': put_price}
         # Add other bond type parameters as needed...
@@ -375,7 +627,7 @@ if analysis_type == "Bond Pricing & Analytics":
         col1, col2, col3 = st.columns(3)
         
         with col1:
-            st.metric("Bond Price", f"${results['Price']:,.2f}")
+            st.metric("Bond Price", format_currency(results['Price']))
             st.metric("Yield to Maturity", f"{results['Yield to Maturity']*100:.2f}%")
             
         with col2:
@@ -385,7 +637,7 @@ if analysis_type == "Bond Pricing & Analytics":
         with col3:
             st.metric("Convexity", f"{results['Convexity']:,.2f}")
             st.metric("Yield Value of 1bp (YV01)", 
-                     f"${results['Price'] * results['Modified Duration'] * 0.0001:,.2f}")
+                     format_currency(results['Dollar Duration'] * 0.0001))
         
         # Cash flow visualization
         st.subheader("Cash Flow Analysis")
@@ -412,7 +664,7 @@ if analysis_type == "Bond Pricing & Analytics":
                 "Period": np.arange(1, len(results['Cash Flows'])+1),
                 "Cash Flow": results['Cash Flows'],
                 "Discount Factor": results['Discount Factors'],
-                "Present Value": results['Cash Flows'] * results['Discount Factors']
+                "Present Value": results['Present Values']
             })
             st.dataframe(df.style.format({
                 "Cash Flow": "${:,.2f}",
@@ -428,7 +680,7 @@ if analysis_type == "Bond Pricing & Analytics":
                 - **Modified Duration**: {results['Modified Duration']:.2f} years  
                   *Price sensitivity to yield changes (% price change per 1% yield change)*
                 
-                - **Dollar Duration**: ${results['Price'] * results['Modified Duration']:,.2f}  
+                - **Dollar Duration**: ${results['Dollar Duration']:,.2f}  
                   *Price sensitivity in dollar terms per 1% yield change*
             """)
             
@@ -462,19 +714,11 @@ elif analysis_type == "Portfolio Analysis":
                 help="Choose how to input portfolio holdings"
             )
             
-            if input_method == "Manual Entry":
-                num_bonds = st.number_input(
-                    "Number of Bonds in Portfolio:",
-                    min_value=1,
-                    max_value=50,
-                    value=3,
-                    step=1
-                )
-            else:
+            if input_method == "CSV Upload":
                 uploaded_file = st.file_uploader(
                     "Upload Portfolio CSV:",
                     type=["csv"],
-                    help="Upload a CSV file with columns: BondID, FaceValue, CouponRate, YTM, YearsToMaturity, Weight"
+                    help="Upload a CSV file with columns: BondID, FaceValue, CouponRate, YTM, YearsToMaturity, Weight (rates and weight in %)"
                 )
         
         with col2:
@@ -495,109 +739,121 @@ elif analysis_type == "Portfolio Analysis":
                     step=0.1
                 )
     
-    # Dynamic bond input form for manual entry
+    # Editable holdings grid for manual entry
     if input_method == "Manual Entry":
         st.subheader("Bond Holdings Details")
-        portfolio_bonds = []
-        
-        for i in range(num_bonds):
-            with st.expander(f"Bond {i+1} Details", expanded=False):
-                cols = st.columns(3)
-                
-                with cols[0]:
-                    bond_id = st.text_input(f"ID/Bond Name {i+1}", value=f"Bond_{i+1}")
-                    face_value = st.number_input(
-                        f"Face Value {i+1}",
-                        min_value=0.0,
-                        value=1000.0,
-                        step=100.0
-                    )
-                
-                with cols[1]:
-                    coupon_rate = st.number_input(
-                        f"Coupon Rate % {i+1}",
-                        min_value=0.0,
-                        max_value=100.0,
-                        value=5.0,
-                        step=0.25
-                    )
-                    ytm = st.number_input(
-                        f"YTM % {i+1}",
-                        min_value=0.0,
-                        max_value=100.0,
-                        value=6.0,
-                        step=0.25
-                    )
-                
-                with cols[2]:
-                    maturity = st.number_input(
-                        f"Years to Maturity {i+1}",
-                        min_value=0.0,
-                        max_value=100.0,
-                        value=10.0,
-                        step=0.5
-                    )
-                    weight = st.number_input(
-                        f"Portfolio Weight % {i+1}",
-                        min_value=0.0,
-                        max_value=100.0,
-                        value=round(100/num_bonds, 2),
-                        step=1.0
-                    )
-                
-                portfolio_bonds.append({
-                    'id': bond_id,
-                    'face_value': face_value,
-                    'coupon_rate': coupon_rate,
-                    'ytm': ytm,
-                    'maturity': maturity,
-                    'weight': weight/100
-                })
+        # Three default holdings; rows are added or removed in the grid itself
+        holdings_df = st.data_editor(
+            pd.DataFrame({
+                "ID/Bond Name": ["Bond_1", "Bond_2", "Bond_3"],
+                "Face Value": 1000.0,
+                "Coupon Rate %": 5.0,
+                "YTM %": 6.0,
+                "Years to Maturity": 10.0,
+                "Portfolio Weight %": 33.33
+            }),
+            key="holdings_editor",
+            num_rows="dynamic",
+            hide_index=True,
+            use_container_width=True,
+            column_config={
+                "ID/Bond Name": st.column_config.TextColumn(required=True),
+                "Face Value": st.column_config.NumberColumn(
+                    min_value=0.0, step=100.0, default=1000.0, required=True),
+                "Coupon Rate %": st.column_config.NumberColumn(
+                    min_value=0.0, max_value=100.0, step=0.25, default=5.0, required=True),
+                "YTM %": st.column_config.NumberColumn(
+                    min_value=0.0, max_value=100.0, step=0.25, default=6.0, required=True),
+                "Years to Maturity": st.column_config.NumberColumn(
+                    min_value=0.0, max_value=100.0, step=0.5, default=10.0, required=True),
+                "Portfolio Weight %": st.column_config.NumberColumn(
+                    min_value=0.0, max_value=100.0, step=1.0, required=True)
+            }
+        ).dropna()
+        
+        # Columnar holdings table, one column per bond attribute
+        portfolio_bonds = holdings_df.rename(columns={
+            "ID/Bond Name": 'id',
+            "Face Value": 'face_value',
+            "Coupon Rate %": 'coupon_rate',
+            "YTM %": 'ytm',
+            "Years to Maturity": 'maturity',
+            "Portfolio Weight %": 'weight'
+        })
+        portfolio_bonds['weight'] /= 100
     else:
         # Process uploaded CSV
         if uploaded_file is not None:
             try:
-                portfolio_bonds = pd.read_csv(uploaded_file).to_dict('records')
+                portfolio_bonds = pd.read_csv(
+                    uploaded_file,
+                    usecols=['BondID', 'FaceValue', 'CouponRate', 'YTM', 'YearsToMaturity', 'Weight'],
+                    dtype={
+                        'BondID': str,
+                        'FaceValue': np.float64,
+                        'CouponRate': np.float64,
+                        'YTM': np.float64,
+                        'YearsToMaturity': np.float64,
+                        'Weight': np.float64
+                    },
+                    engine='c'
+                ).rename(columns={
+                    'BondID': 'id',
+                    'FaceValue': 'face_value',
+                    'CouponRate': 'coupon_rate',
+                    'YTM': 'ytm',
+                    'YearsToMaturity': 'maturity',
+                    'Weight': 'weight'
+                })[['id', 'face_value', 'coupon_rate', 'ytm', 'maturity', 'weight']]
+                portfolio_bonds['weight'] /= 100
                 st.success("CSV successfully loaded!")
-                st.dataframe(pd.DataFrame(portfolio_bonds))
+                st.dataframe(portfolio_bonds)
             except Exception as e:
                 st.error(f"Error reading CSV file: {str(e)}")
-                portfolio_bonds = []
+                portfolio_bonds = pd.DataFrame()
         else:
-            portfolio_bonds = []
+            portfolio_bonds = pd.DataFrame()
             st.warning("Please upload a CSV file to continue")
     
     # Portfolio calculations
-    if st.button("Analyze Portfolio", key="portfolio_button") and portfolio_bonds:
-        # Calculate individual bond metrics
-        for bond in portfolio_bonds:
-            metrics = calculate_bond_metrics(
-                face_value=bond['face_value'],
-                coupon_rate=bond['coupon_rate'],
-                ytm=bond['ytm'],
-                years_to_maturity=bond['maturity'],
-                coupon_freq="Semi-Annual",  # Default for portfolio analysis
-                bond_type="Vanilla Fixed Rate"  # Default for portfolio analysis
+    # Holdings fingerprint: pricing only reruns when the portfolio changes,
+    # not when the yield shift slider or other widgets trigger a rerun
+    portfolio_hash = hash(pd.util.hash_pandas_object(portfolio_bonds, index=False).to_numpy().tobytes())
+    
+    if st.button("Analyze Portfolio", key="portfolio_button") and not portfolio_bonds.empty:
+        if st.session_state.get('portfolio_hash') != portfolio_hash:
+            # Create portfolio DataFrame with all holdings priced in one batch
+            portfolio_df = price_portfolio(
+                portfolio_bonds,
+                coupon_freq="Semi-Annual"  # Default for portfolio analysis
             )
-            bond.update(metrics)
-        
-        # Create portfolio DataFrame
-        portfolio_df = pd.DataFrame(portfolio_bonds)
-        
-        # Calculate weighted portfolio metrics
-        portfolio_metrics = {
-            'Total Value': (portfolio_df['weight'] * portfolio_df['Price']).sum(),
-            'Weighted YTM': (portfolio_df['weight'] * portfolio_df['Yield to Maturity']).sum(),
-            'Weighted Duration': (portfolio_df['weight'] * portfolio_df['Modified Duration']).sum(),
-            'Weighted Convexity': (portfolio_df['weight'] * portfolio_df['Convexity']).sum()
-        }
+            
+            # Calculate weighted portfolio metrics
+            weights = portfolio_df['weight'].to_numpy()
+            portfolio_metrics = {
+                'Total Value': np.vdot(weights, portfolio_df['Price'].to_numpy()),
+                'Weighted YTM': np.vdot(weights, portfolio_df['Yield to Maturity'].to_numpy()),
+                'Weighted Duration': np.vdot(weights, portfolio_df['Modified Duration'].to_numpy()),
+                'Weighted Convexity': np.vdot(weights, portfolio_df['Convexity'].to_numpy())
+            }
+            
+            # Store calculated values in session state
+            st.session_state.portfolio_metrics = portfolio_metrics
+            st.session_state.portfolio_df = portfolio_df
+            st.session_state.portfolio_hash = portfolio_hash
+    
+    # Show the analysis while the priced portfolio matches the current holdings
+    if not portfolio_bonds.empty and st.session_state.get('portfolio_hash') == portfolio_hash:
+        portfolio_df = st.session_state.portfolio_df
+        portfolio_metrics = st.session_state.portfolio_metrics
+        weights = portfolio_df['weight'].to_numpy()
         
         # Display portfolio summary
         st.subheader("Portfolio Summary")
         col1, col2, col3 = st.columns(3)
         
         with col1:
-            st.metric("Total Portfolio Value", f"${portfolio_metrics['Total Value']:,.2f}")
+            st.metric("Total Portfolio Value", format_currency(portfolio_metrics['Total Value']))
             st.metric("Number of Holdings", len(portfolio_df))
             
         with col2:
@@ -612,15 +868,6 @@ elif analysis_type == "Portfolio Analysis":
         # Risk analysis
         st.subheader("Portfolio Risk Analysis")
         
-        # Initialize session state for portfolio metrics if not exists
-        if 'portfolio_metrics' not in st.session_state:
-            st.session_state.portfolio_metrics = portfolio_metrics
-            st.session_state.portfolio_df = portfolio_df
-        
-        # Store calculated values in session state
-        st.session_state.portfolio_metrics = portfolio_metrics
-        st.session_state.portfolio_df = portfolio_df
-        
         # Yield curve shift analysis with session state
         if 'shift_size' not in st.session_state:
             st.session_state.shift_size = 100
@@ -639,42 +886,48 @@ elif analysis_type == "Portfolio Analysis":
         )
         
         # Calculate price impact using session state values
-        portfolio_df = st.session_state.portfolio_df.copy()
-        portfolio_metrics = st.session_state.portfolio_metrics
+        # (kept as an array so the stored DataFrame is never copied or modified)
+        # Duration + convexity approximation, (-MD*dy + 0.5*C*dy^2) * Price,
+        # accumulated into one preallocated buffer
+        dy = shift_size/10000
+        price_change = np.empty(len(portfolio_df))
+        np.multiply(portfolio_df['Convexity'].to_numpy(), 0.5*dy*dy, out=price_change)
+        price_change -= dy * portfolio_df['Modified Duration'].to_numpy()
+        price_change *= portfolio_df['Price'].to_numpy()
         
-        portfolio_df['price_change'] = (
-            -portfolio_df['Modified Duration'] * (shift_size/10000) * portfolio_df['Price'] +
-            0.5 * portfolio_df['Convexity'] * (shift_size/10000)**2 * portfolio_df['Price']
-        )
-        
-        total_change = (portfolio_df['weight'] * portfolio_df['price_change']).sum()
+        total_change = np.vdot(weights, price_change)
         
         col1, col2 = st.columns(2)
         with col1:
             st.metric(
                 f"Portfolio Value Change ({shift_size}bps shift)",
-                f"${total_change:,.2f}",
+                format_currency(total_change),
                 delta_color="inverse"
             )
             
         with col2:
             st.metric(
                 "Estimated New Portfolio Value",
-                f"${portfolio_metrics['Total Value'] + total_change:,.2f}"
+                format_currency(portfolio_metrics['Total Value'] + total_change)
             )
         
         # Display bond-by-bond impact
-        fig3 = go.Figure()
-        fig3.add_trace(go.Bar(
-            x=portfolio_df['id'],
-            y=portfolio_df['price_change'],
-            name='Price Impact',
-            marker_color=np.where(portfolio_df['price_change'] < 0, 'red', 'green')
-        ))
-        fig3.update_layout(
-            title=f'Price Impact per Holding ({shift_size}bps Yield Change)',
-            yaxis_title='Price Change ($)'
-        )
+        # (figure is built once per priced portfolio; slider moves only update the bars)
+        if st.session_state.get('impact_fig_hash') != portfolio_hash:
+            fig3 = go.Figure()
+            fig3.add_trace(go.Bar(
+                x=portfolio_df['id'],
+                name='Price Impact'
+            ))
+            fig3.update_layout(yaxis_title='Price Change ($)')
+            st.session_state.impact_fig = fig3
+            st.session_state.impact_fig_hash = portfolio_hash
+        
+        fig3 = st.session_state.impact_fig
+        fig3.data[0].y = price_change
+        # Red for losses, green otherwise, via a two-entry lookup
+        fig3.data[0].marker.color = np.array(['red', 'green'])[(price_change >= 0).astype(np.uint8)]
+        fig3.layout.title.text = f'Price Impact per Holding ({shift_size}bps Yield Change)'
         st.plotly_chart(fig3, use_container_width=True)
 
 # =============================================
@@ -719,15 +972,17 @@ elif analysis_type == "Yield Curve Analysis":
                 )
                 
                 try:
-                    maturities = [float(x.strip()) for x in manual_maturities.split(",")]
-                    yields = [float(x.strip())/100 for x in manual_yields.split(",")]
-                except:
+                    maturities = np.fromstring(manual_maturities, sep=",")
+                    yields = np.fromstring(manual_yields, sep=",")/100
+                except ValueError:
+                    maturities = yields = np.empty(0)
+                
+                if maturities.size == 0 or maturities.size != yields.size:
                     st.warning("Please enter valid comma-separated numbers")
-                    maturities = []
-                    yields = []
+                    maturities = yields = np.empty(0)
             else:
-                maturities = [0.25, 0.5, 1, 2, 3, 5, 7, 10, 20, 30]
-                yields = [0.005, 0.007, 0.01, 0.015, 0.018, 0.022, 0.025, 0.028, 0.032, 0.035]
+                maturities = np.array([0.25, 0.5, 1, 2, 3, 5, 7, 10, 20, 30])
+                yields = np.array([0.005, 0.007, 0.01, 0.015, 0.018, 0.022, 0.025, 0.028, 0.032, 0.035])
                 st.info(f"Using sample {curve_type} yield curve data")
     
     # INTERPOLATION SECTION
@@ -752,19 +1007,18 @@ elif analysis_type == "Yield Curve Analysis":
                 beta2 = st.number_input("β₂ (Curvature)", value=0.01, step=0.01)
                 tau = st.number_input("τ (Decay rate)", value=1.0, step=0.1)
     
-    if maturities and yields:
+    if maturities.size and yields.size:
+        # Curve extrema, reused by plotting, analytics and stress tests
+        mat_min, mat_max = float(maturities.min()), float(maturities.max())
+        
         st.subheader("Yield Curve Visualization")
-        plot_maturities = np.linspace(min(maturities), max(maturities), 100)
+        plot_maturities = np.linspace(mat_min, mat_max, 100)
         
         if model_type == "Linear":
             plot_yields = np.interp(plot_maturities, maturities, yields)
         elif model_type == "Polynomial":
-            coeffs = np.polyfit(maturities, yields, degree)
-            poly = np.poly1d(coeffs)
-            plot_yields = poly(plot_maturities)
+            plot_yields = fit_polynomial_curve(maturities, yields, degree)(plot_maturities)
         else:  # Nelson-Siegel
-            def nelson_siegel(t, b0, b1, b2, tau):
-                return b0 + b1*(1-np.exp(-t/tau))/(t/tau) + b2*((1-np.exp(-t/tau))/(t/tau)-np.exp(-t/tau))
             plot_yields = nelson_siegel(plot_maturities, beta0, beta1, beta2, tau)
         
         # Create Plotly figure
@@ -773,7 +1027,7 @@ elif analysis_type == "Yield Curve Analysis":
         # Raw data points
         fig.add_trace(go.Scatter(
             x=maturities,
-            y=[y*100 for y in yields],
+            y=yields*100,
             mode='markers',
             name='Market Data',
             marker=dict(size=10, color='red')
@@ -782,7 +1036,7 @@ elif analysis_type == "Yield Curve Analysis":
         # Fitted curve
         fig.add_trace(go.Scatter(
             x=plot_maturities,
-            y=[y*100 for y in plot_yields],
+            y=plot_yields*100,
             mode='lines',
             name=f'{model_type} Fit',
             line=dict(width=3, color='blue')
@@ -802,13 +1056,14 @@ elif analysis_type == "Yield Curve Analysis":
         # Curve analytics
         st.subheader("Curve Analytics")
         
+        # Key tenor yields in a single interpolation pass
+        y2, y5, y10 = np.interp([2.0, 5.0, 10.0], maturities, yields)
+        
         col1, col2, col3 = st.columns(3)
         
         with col1:
             # Calculate slope (10Y-2Y)
-            if max(maturities) >= 10 and min(maturities) <= 2:
-                y10 = np.interp(10, maturities, yields)
-                y2 = np.interp(2, maturities, yields)
+            if mat_max >= 10 and mat_min <= 2:
                 slope = (y10 - y2)*100
                 st.metric("10Y-2Y Slope", f"{slope:.2f} bps")
             else:
@@ -816,8 +1071,7 @@ elif analysis_type == "Yield Curve Analysis":
             
         with col2:
             # Calculate curvature (2*5Y - 2Y - 10Y)
-            if max(maturities) >= 10 and min(maturities) <= 2 and 5 in maturities:
-                y5 = np.interp(5, maturities, yields)
+            if mat_max >= 10 and mat_min <= 2 and 5 in maturities:
                 curvature = (2*y5 - y2 - y10)*10000
                 st.metric("Curvature (Butterfly)", f"{curvature:.2f} bps")
         
@@ -847,9 +1101,8 @@ elif analysis_type == "Yield Curve Analysis":
                 end_year = st.number_input("End Year", min_value=0.0, value=2.0, step=0.5)
             
             if end_year > start_year:
-                y_start = np.interp(start_year, maturities, yields)
-                y_end = np.interp(end_year, maturities, yields)
-                forward_rate = (((1+y_end)**end_year)/((1+y_start)**start_year))**(1/(end_year-start_year)) - 1
+                y_start, y_end = np.interp([start_year, end_year], maturities, yields)
+                forward_rate = implied_forward_rate(y_start, start_year, y_end, end_year)
                 
                 st.metric(
                     f"Implied Forward Rate {start_year}-{end_year}Y",
@@ -876,27 +1129,28 @@ elif analysis_type == "Yield Curve Analysis":
             )
             
             # Apply shifts
+            shift = shift_size/10000
             if shift_type == "Parallel":
-                new_yields = [y + shift_size/10000 for y in yields]
+                new_yields = yields + shift
             elif shift_type == "Steepening":
-                new_yields = [y + (shift_size/10000)*(t/max(maturities)) for t,y in zip(maturities,yields)]
+                new_yields = yields + shift*(maturities/mat_max)
             elif shift_type == "Flattening":
-                new_yields = [y + (shift_size/10000)*(1-t/max(maturities)) for t,y in zip(maturities,yields)]
+                new_yields = yields + shift*(1-maturities/mat_max)
             else:  # Hump
-                new_yields = [y + (shift_size/10000)*np.exp(-((t-5)**2)/10) for t,y in zip(maturities,yields)]
+                new_yields = yields + shift*np.exp(-((maturities-5)**2)/10)
             
             # Plot comparison
             fig2 = go.Figure()
             fig2.add_trace(go.Scatter(
                 x=maturities,
-                y=[y*100 for y in yields],
+                y=yields*100,
                 mode='lines+markers',
                 name='Current Curve',
                 line=dict(width=2, color='blue')
             ))
             fig2.add_trace(go.Scatter(
                 x=maturities,
-                y=[y*100 for y in new_yields],
+                y=new_yields*100,
                 mode='lines+markers',
                 name=f'Shifted Curve ({shift_type})',
                 line=dict(width=2, color='red', dash='dash')
@@ -921,9 +1175,16 @@ elif analysis_type == "Yield Curve Analysis":
                 original_yield = np.interp(example_maturity, maturities, yields)
                 new_yield = np.interp(example_maturity, maturities, new_yields)
                 
-                # Simplified price calculation
-                original_price = sum([example_coupon/100/(1+original_yield)**t for t in np.arange(1, example_maturity+1)]) + 1/(1+original_yield)**example_maturity
-                new_price = sum([example_coupon/100/(1+new_yield)**t for t in np.arange(1, example_maturity+1)]) + 1/(1+new_yield)**example_maturity
+                # Coupon time grid only depends on the maturity, so keep it
+                # across reruns (e.g. shift slider moves)
+                if st.session_state.get('coupon_times_maturity') != example_maturity:
+                    st.session_state.coupon_times_maturity = example_maturity
+                    st.session_state.coupon_times = np.arange(1, example_maturity+1)
+                coupon_times = st.session_state.coupon_times
+                
+                # Simplified price calculation (annual coupons plus principal)
+                original_price = example_coupon/100 * np.sum((1+original_yield)**-coupon_times) + (1+original_yield)**-example_maturity
+                new_price = example_coupon/100 * np.sum((1+new_yield)**-coupon_times) + (1+new_yield)**-example_maturity
                 
                 st.metric(
                     f"Price Change for {example_maturity}Y {example_coupon}% Bond",
@@ -992,7 +1253,7 @@ elif analysis_type == "Risk Metrics":
             
             risk_coupon_freq = st.selectbox(
                 "Coupon Frequency:",
-                ["Annual", "Semi-Annual", "Quarterly"],
+                COUPON_FREQS,
                 index=1,
                 key="risk_coupon_freq"
             )
@@ -1034,12 +1295,13 @@ elif analysis_type == "Risk Metrics":
         col1, col2 = st.columns(2)
         
         with col1:
-            confidence_level = st.selectbox(
+            confidence_idx = st.selectbox(
                 "Confidence Level:",
-                [90, 95, 99, 99.5, 99.9],
+                range(len(CONFIDENCE_LEVELS)),
                 index=2,
-                format_func=lambda x: f"{x}%"
+                format_func=lambda i: f"{CONFIDENCE_LEVELS[i]}%"
             )
+            confidence_level = CONFIDENCE_LEVELS[confidence_idx]
             
         with col2:
             horizon_days = st.number_input(
@@ -1065,14 +1327,14 @@ elif analysis_type == "Risk Metrics":
         convexity = bond_metrics['Convexity']
         
         rate_shock = yield_vol * np.sqrt(horizon_days) / 10000
-        st.session_state.dollar_duration = price * mod_duration
+        st.session_state.dollar_duration = bond_metrics['Dollar Duration']
         st.session_state.dollar_convexity = price * convexity
         st.session_state.price = price
         
         delta_price_linear = -st.session_state.dollar_duration * rate_shock
         delta_price_convex = delta_price_linear + 0.5 * st.session_state.dollar_convexity * (rate_shock**2)
         
-        z_score = {90: 1.282, 95: 1.645, 99: 2.326, 99.5: 2.576, 99.9: 3.090}[confidence_level]
+        z_score = Z_SCORES[confidence_idx]
         price_volatility = st.session_state.dollar_duration * yield_vol / 10000
         var = z_score * price_volatility * np.sqrt(horizon_days)
         
@@ -1083,8 +1345,8 @@ elif analysis_type == "Risk Metrics":
         col1, col2, col3 = st.columns(3)
         
         with col1:
-            st.metric("Price", f"${price:,.2f}")
-            st.metric("DV01", f"${st.session_state.dollar_duration * 0.0001:,.2f}",
+            st.metric("Price", format_currency(price))
+            st.metric("DV01", format_currency(st.session_state.dollar_duration * 0.0001),
                      help="Price change per 1bp yield move")
             
         with col2:
@@ -1102,7 +1364,7 @@ elif analysis_type == "Risk Metrics":
         with col1:
             st.metric(
                 f"{confidence_level}% {horizon_days}-day VaR",
-                f"${var:,.2f}",
+                format_currency(var),
                 delta=f"{-var/price*100:.2f}% of price",
                 delta_color="inverse"
             )
@@ -1110,14 +1372,14 @@ elif analysis_type == "Risk Metrics":
         with col2:
             st.metric(
                 "Expected Price Change",
-                f"${delta_price_convex:,.2f}",
+                format_currency(delta_price_convex),
                 help="Including convexity adjustment"
             )
             
         with col3:
             st.metric(
                 "Liquidity Adjustment",
-                f"${liquidity_adj:,.2f}",
+                format_currency(liquidity_adj),
                 help="Estimated bid-ask spread impact"
             )
         
@@ -1147,22 +1409,25 @@ elif analysis_type == "Risk Metrics":
         st.markdown("**Historical & Hypothetical Scenarios**")
         
         if 'selected_scenario' not in st.session_state:
-            st.session_state.selected_scenario = "2020 COVID Crisis"
+            st.session_state.selected_scenario = 0
         
         def update_scenario():
             st.session_state.selected_scenario = st.session_state.scenario_selectbox
         
         scenario = st.selectbox(
             "Select Scenario:",
-            ["2020 COVID Crisis", "2008 Lehman Shock", "1994 Bond Massacre", "Custom Shock"],
+            range(len(STRESS_SCENARIOS)),
             index=0,
+            format_func=lambda i: STRESS_SCENARIOS[i],
             key="scenario_selectbox",
             on_change=update_scenario
         )
         
-        current_scenario = st.session_state.selected_scenario
+        scenario_idx = st.session_state.selected_scenario
+        current_scenario = STRESS_SCENARIOS[scenario_idx]
+        is_historical = scenario_idx < len(SCENARIO_SHOCKS)
         
-        if current_scenario == "Custom Shock":
+        if not is_historical:
             custom_shock = st.number_input(
                 "Yield Shock (bps):",
                 min_value=-500,
@@ -1172,12 +1437,7 @@ elif analysis_type == "Risk Metrics":
                 key="custom_shock_input"
             )
         else:
-            scenario_shocks = {
-                "2020 COVID Crisis": 75,
-                "2008 Lehman Shock": 125,
-                "1994 Bond Massacre": 200
-            }
-            custom_shock = scenario_shocks[current_scenario]
+            custom_shock = SCENARIO_SHOCKS[scenario_idx]
         
         if st.session_state.dollar_duration == 0:
             st.warning("Please calculate risk metrics first")
@@ -1189,18 +1449,13 @@ elif analysis_type == "Risk Metrics":
             
             st.metric(
                 f"Scenario Impact ({current_scenario})",
-                f"${scenario_delta:,.2f}",
+                format_currency(scenario_delta),
                 delta=f"{scenario_delta/st.session_state.price*100:.2f}%",
                 delta_color="inverse"
             )
             
-            if current_scenario != "Custom Shock":
-                historical_recovery = {
-                    "2020 COVID Crisis": "3 months",
-                    "2008 Lehman Shock": "12 months",
-                    "1994 Bond Massacre": "6 months"
-                }
-                st.markdown(f"**Historical Recovery Time:** {historical_recovery[current_scenario]}")
+            if is_historical:
+                st.markdown(f"**Historical Recovery Time:** {SCENARIO_RECOVERY[scenario_idx]}")
 
 # =============================================
 # CREDIT RISK ANALYSIS FUNCTION
@@ -1214,9 +1469,7 @@ elif analysis_type == "Credit Risk Analysis":
         with col1:
             credit_rating = st.selectbox(
                 "Credit Rating:",
-                ["AAA", "AA+", "AA", "AA-", "A+", "A", "A-", 
-                 "BBB+", "BBB", "BBB-", "BB+", "BB", "BB-", "B+", "B", "B-", 
-                 "CCC+", "CCC", "CCC-", "CC", "C", "D"],
+                CREDIT_RATINGS,
                 index=7,
                 help="Standard & Poor's rating scale"
             )
@@ -1249,6 +1502,21 @@ elif analysis_type == "Credit Risk Analysis":
                 help="Expected recovery in case of default"
             )
     
+    # Credit VaR widgets rerun on their own when the confidence level changes
+    @st.fragment
+    def credit_var_block(cds_spread, recovery_rate):
+        confidence_idx = st.selectbox(
+            "Confidence Level:",
+            range(len(CONFIDENCE_LEVELS)),
+            index=2,
+            format_func=lambda i: f"{CONFIDENCE_LEVELS[i]}",
+            key="credit_var_conf"
+        )
+        confidence_level = CONFIDENCE_LEVELS[confidence_idx]
+        credit_var = calculate_credit_var(cds_spread, recovery_rate, confidence_idx)
+        st.metric("1Y Credit VaR", f"{credit_var:.2f}%", 
+                 help=f"At {confidence_level}% confidence level")
+    
     # CreditMetrics Model Implementation
     with st.expander("📈 CreditMetrics Model (J.P. Morgan)", expanded=False):
         st.markdown("""
@@ -1264,27 +1532,11 @@ elif analysis_type == "Credit Risk Analysis":
         
         col1, col2 = st.columns(2)
         with col1:
-            rating_matrix = pd.DataFrame({
-                'Rating': ['AAA', 'AA', 'A', 'BBB', 'BB', 'B', 'CCC', 'Default'],
-                '1Y Transition (%)': [0.09, 2.27, 91.05, 5.52, 0.74, 0.26, 0.01, 0.06],
-                '5Y Spread (bps)': [15, 30, 50, 120, 300, 550, 1000, 5000]
-            })
+            rating_matrix = rating_transition_matrix()
             st.dataframe(rating_matrix.style.format({'1Y Transition (%)': '{:.2f}%'}))
         
         with col2:
-            confidence_level = st.selectbox(
-                "Confidence Level:",
-                [90, 95, 99, 99.5, 99.9],
-                index=2,
-                key="credit_var_conf"
-            )
-            
-            # Simplified Credit VaR without scipy.stats
-            z_scores = {90: 1.282, 95: 1.645, 99: 2.326, 99.5: 2.576, 99.9: 3.090}
-            risk_neutral_pd = (cds_spread/10000)/(1-recovery_rate/100)
-            credit_var = risk_neutral_pd * z_scores[confidence_level] * 100
-            st.metric("1Y Credit VaR", f"{credit_var:.2f}%", 
-                     help=f"At {confidence_level}% confidence level")
+            credit_var_block(cds_spread, recovery_rate)
     
     # CreditRisk+ Model Implementation
     with st.expander("📉 CreditRisk+ Model (CSFB)", expanded=False):
@@ -1320,12 +1572,11 @@ elif analysis_type == "Credit Risk Analysis":
         with col2:
             # CreditRisk+ calculations
             lambda_param = probability_default/100
-            unexpected_loss = exposure * np.sqrt(
-                (probability_default/100)*(1-probability_default/100)*(default_volatility/100)**2
-            )
+            unexpected_loss = creditrisk_unexpected_loss(exposure, probability_default, default_volatility)
             
-            st.metric("Expected Loss", f"${exposure * probability_default/100 * (1-recovery_rate/100):,.2f}")
-            st.metric("Unexpected Loss", f"${unexpected_loss:,.2f}")
+            expected_loss = exposure * probability_default/100 * (1-recovery_rate/100)
+            st.metric("Expected Loss", format_currency(expected_loss))
+            st.metric("Unexpected Loss", format_currency(unexpected_loss))
     
     # Advanced Credit Analytics
     with st.expander("🧠 Deep Credit Analysis", expanded=False):
@@ -1381,11 +1632,7 @@ elif analysis_type == "Credit Risk Analysis":
         """)
         
         # Credit risk heatmap
-        ratings = ['AAA', 'AA', 'A', 'BBB', 'BB', 'B', 'CCC']
-        default_probs = [0.03, 0.06, 0.15, 0.30, 1.20, 5.00, 20.00]
-        fig = px.bar(x=ratings, y=default_probs, 
-                    labels={'x':'Credit Rating', 'y':'Historical PD (%)'},
-                    title='Historical Default Probabilities by Rating')
+        fig = default_probability_figure()
         st.plotly_chart(fig, use_container_width=True)
 
 # =============================================
@@ -1394,28 +1641,45 @@ elif analysis_type == "Credit Risk Analysis":
 elif analysis_type == "Bond Comparison Tool":
     st.header("🔍 Bond Comparison Tool")
     
+    # One date snapshot per rerun for form defaults and newly added bonds
+    today = datetime.now().date()
+    
     # Initialize session state
-    if 'bond_data' not in st.session_state:
-        st.session_state.bond_data = []
+    if 'bonds_df' not in st.session_state:
+        st.session_state.bonds_df = pd.DataFrame(columns=COMPARISON_COLUMNS)
+        st.session_state.bonds_version = 0
         st.session_state.advanced_mode = False
     
-    # Function to add new bond
+    # Bumped whenever bonds are added or cleared so derived results know to refresh
+    def touch_bonds():
+        st.session_state.bonds_version += 1
+    
+    # Function to add new bond (one row per bond, one column per field)
+    # Returns False without adding if an identical bond is already listed
     def add_bond(name, purchase_price, face_value, coupon_rate, coupon_freq, purchase_date, maturity_date):
-        st.session_state.bond_data.append({
+        bonds = st.session_state.bonds_df
+        bond_key = pd.Series({
             'name': name,
             'purchase_price': purchase_price,
             'face_value': face_value,
             'coupon_rate': coupon_rate,
             'coupon_freq': coupon_freq,
             'purchase_date': purchase_date,
-            'maturity_date': maturity_date,
-            'current_date': datetime.now().date(),
-            'ytm': None,
-            'duration': None,
+            'maturity_date': maturity_date
+        })
+        if (bonds[bond_key.index] == bond_key).all(axis=1).any():
+            return False
+        
+        # ytm/duration are left empty and filled in by calculate_basic_metrics
+        bonds.loc[len(bonds)] = {
+            **bond_key,
+            'current_date': today,
             'credit_spread': 100,  # Default values for advanced
             'rating': 'BBB',
             'sector': 'Corporate'
-        })
+        }
+        touch_bonds()
+        return True
     
     # Basic input form - CORRECTED FORM WITH SUBMIT BUTTON
     with st.expander("➕ Add New Bond (Basic)", expanded=True):
@@ -1430,39 +1694,80 @@ elif analysis_type == "Bond Comparison Tool":
             
             with col2:
                 coupon_rate = form.number_input("Coupon Rate (% p.a.):", min_value=0.0, max_value=100.0, value=5.0)
-                coupon_freq = form.selectbox("Coupon Frequency:", ["Annual", "Semi-Annual", "Quarterly"])
-                purchase_date = form.date_input("Purchase Date:", value=datetime.now().date())
+                coupon_freq = form.selectbox("Coupon Frequency:", COUPON_FREQS)
+                purchase_date = form.date_input("Purchase Date:", value=today)
                 maturity_date = form.date_input("Maturity Date:", 
-                                             value=datetime.now().date() + timedelta(days=365*5))
+                                             value=today + timedelta(days=365*5))
             
             submitted = form.form_submit_button("Add Bond")
             if submitted and name:
-                add_bond(name, purchase_price, face_value, coupon_rate, coupon_freq, purchase_date, maturity_date)
-                st.success(f"Added {name} to comparison")
-                st.rerun()
+                if add_bond(name, purchase_price, face_value, coupon_rate, coupon_freq, purchase_date, maturity_date):
+                    st.success(f"Added {name} to comparison")
+                    st.rerun()
+                else:
+                    st.warning(f"{name} is already in the comparison")
     
-    # Calculate basic metrics for all bonds
+    # Calculate basic metrics for bonds added since the last run
     def calculate_basic_metrics():
-        for bond in st.session_state.bond_data:
-            try:
-                # Calculate years to maturity from current date
-                years_to_maturity = (bond['maturity_date'] - bond['current_date']).days / 365.25
-                
-                # Calculate periodic coupon payment
-                freq_map = {"Annual": 1, "Semi-Annual": 2, "Quarterly": 4}
-                periods_per_year = freq_map[bond['coupon_freq']]
-                coupon_payment = bond['face_value'] * (bond['coupon_rate']/100) / periods_per_year
-                
-                # Simplified YTM calculation (approximation)
-                total_coupons = coupon_payment * years_to_maturity * periods_per_year
-                total_gain = bond['face_value'] - bond['purchase_price']
-                bond['ytm'] = ((total_coupons + total_gain) / years_to_maturity) / bond['purchase_price']
-                
-                # Simplified duration calculation
-                bond['duration'] = years_to_maturity / (1 + bond['ytm'])
-            except:
-                bond['ytm'] = 0
-                bond['duration'] = 0
+        if st.session_state.get('metrics_version') == st.session_state.bonds_version:
+            return
+        bonds = st.session_state.bonds_df
+        pending = bonds['ytm'].isna()
+        if pending.any():
+            bonds.loc[pending, 'ytm'], bonds.loc[pending, 'duration'] = calculate_ytm_duration(
+                bonds.loc[pending, ['purchase_price', 'face_value', 'coupon_rate',
+                                    'maturity_date', 'current_date']]
+            )
+        st.session_state.metrics_version = st.session_state.bonds_version
+    
+    # Advanced analysis reruns on its own when its parameters or scenario change
+    @st.fragment
+    def advanced_analysis():
+        bonds = st.session_state.bonds_df
+        
+        st.markdown("---")
+        st.subheader("Advanced Analysis")
+        
+        # Advanced parameters: one editable grid, written back to bonds_df.
+        # Keyed on bonds_version so edits don't carry over to a changed bond list.
+        with st.expander("⚙️ Advanced Parameters", expanded=True):
+            advanced_cols = ['credit_spread', 'rating', 'sector']
+            edited = st.data_editor(
+                bonds[['name'] + advanced_cols],
+                hide_index=True,
+                use_container_width=True,
+                disabled=['name'],
+                column_config={
+                    "name": st.column_config.TextColumn("Bond"),
+                    "credit_spread": st.column_config.NumberColumn(
+                        "Credit Spread (bps)", min_value=0, max_value=1000, step=1, required=True),
+                    "rating": st.column_config.SelectboxColumn(
+                        "Rating", options=RATINGS, required=True),
+                    "sector": st.column_config.TextColumn("Sector")
+                },
+                key=f"advanced_params_{st.session_state.bonds_version}"
+            )
+            bonds[advanced_cols] = edited[advanced_cols]
+        
+        # Advanced analysis tabs
+        tab1, tab2 = st.tabs(["Risk-Return Profile", "Scenario Analysis"])
+        
+        with tab1:
+            st.markdown("#### Risk-Return Profile")
+            fig = risk_return_figure(bonds[['name', 'duration', 'ytm', 'rating', 'credit_spread']])
+            st.plotly_chart(fig, use_container_width=True)
+        
+        with tab2:
+            st.markdown("#### Scenario Analysis")
+            scenario = st.selectbox("Select Scenario:", 
+                                  COMPARISON_SCENARIO_NAMES)
+            
+            # Price change (%) = -duration x shift (%), one multiply over the float array
+            duration = bonds['duration'].to_numpy(dtype=np.float64)
+            price_change = duration * -COMPARISON_SCENARIOS[scenario]
+            
+            fig = scenario_figure(bonds[['name', 'rating']].assign(price_change=price_change), scenario)
+            st.plotly_chart(fig, use_container_width=True)
     
     # Toggle advanced mode
     if st.button("🛠️ Toggle Advanced Mode"):
@@ -1470,95 +1775,35 @@ elif analysis_type == "Bond Comparison Tool":
         st.rerun()
     
     # Display bonds table
-    if st.session_state.bond_data:
+    bonds = st.session_state.bonds_df
+    if not bonds.empty:
         calculate_basic_metrics()
         
         st.markdown("### Your Bond Portfolio")
-        display_df = pd.DataFrame(st.session_state.bond_data)
         
         # Format columns for display
-        display_cols = ['name', 'purchase_price', 'face_value', 'coupon_rate', 
-                       'coupon_freq', 'ytm', 'duration']
-        display_df = display_df[display_cols]
-        display_df['ytm'] = display_df['ytm'].apply(lambda x: f"{x*100:.2f}%")
-        display_df['duration'] = display_df['duration'].apply(lambda x: f"{x:.2f} years")
-        
-        st.dataframe(display_df)
+        st.dataframe(bonds[COMPARISON_DISPLAY_COLUMNS].style.format({
+            'purchase_price': '{:.2f}',
+            'face_value': '{:.2f}',
+            'coupon_rate': '{:.2f}',
+            'ytm': '{:.2%}',
+            'duration': '{:.2f} years'
+        }))
         
         # Basic comparison charts
         st.markdown("### Basic Comparison")
-        fig = px.bar(display_df, x='name', y='purchase_price', title="Purchase Price Comparison")
+        fig = purchase_price_figure(bonds[['name', 'purchase_price']])
         st.plotly_chart(fig, use_container_width=True)
         
         # Advanced analysis section
         if st.session_state.advanced_mode:
-            st.markdown("---")
-            st.subheader("Advanced Analysis")
-            
-            # Advanced parameters
-            with st.expander("⚙️ Advanced Parameters", expanded=True):
-                cols = st.columns(3)
-                headers = ["Bond", "Credit Spread (bps)", "Rating", "Sector"]
-                for i, h in enumerate(headers[:3]):
-                    cols[i].write(f"**{h}**")
-                
-                for i, bond in enumerate(st.session_state.bond_data):
-                    cols = st.columns(3)
-                    cols[0].write(bond['name'])
-                    
-                    with cols[1]:
-                        bond['credit_spread'] = st.number_input(
-                            label="", 
-                            min_value=0, 
-                            max_value=1000, 
-                            value=bond['credit_spread'], 
-                            key=f"spread_{i}"
-                        )
-                    
-                    with cols[2]:
-                        bond['rating'] = st.selectbox(
-                            label="", 
-                            options=["AAA","AA","A","BBB","BB","B","CCC"], 
-                            index=["AAA","AA","A","BBB","BB","B","CCC"].index(bond['rating']),
-                            key=f"rating_{i}"
-                        )
-            
-            # Advanced analysis tabs
-            tab1, tab2 = st.tabs(["Risk-Return Profile", "Scenario Analysis"])
-            
-            with tab1:
-                st.markdown("#### Risk-Return Profile")
-                adv_df = pd.DataFrame(st.session_state.bond_data)
-                adv_df['ytm_num'] = adv_df['ytm'].astype(float)
-                fig = px.scatter(adv_df, x='duration', y='ytm_num', color='rating',
-                                size='credit_spread', hover_name='name',
-                                title="Risk-Return Profile",
-                                labels={'duration': 'Duration (years)', 'ytm_num': 'Yield to Maturity'})
-                st.plotly_chart(fig, use_container_width=True)
-            
-            with tab2:
-                st.markdown("#### Scenario Analysis")
-                scenario = st.selectbox("Select Scenario:", 
-                                      ["Rates +100bps", "Rates -50bps", "Credit Spread +50bps"])
-                
-                scenario_df = pd.DataFrame(st.session_state.bond_data)
-                scenario_df['duration_num'] = scenario_df['duration'].astype(float)
-                
-                if scenario == "Rates +100bps":
-                    scenario_df['price_change'] = -scenario_df['duration_num'] * 1.0
-                elif scenario == "Rates -50bps":
-                    scenario_df['price_change'] = -scenario_df['duration_num'] * -0.5
-                else: # Credit Spread +50bps
-                    scenario_df['price_change'] = -scenario_df['duration_num'] * 0.5
-                
-                fig = px.bar(scenario_df, x='name', y='price_change', color='rating',
-                            title=f"Price Change in {scenario} Scenario (%)")
-                st.plotly_chart(fig, use_container_width=True)
+            advanced_analysis()
     
     # Clear all button
     if st.button("❌ Clear All Bonds"):
-        st.session_state.bond_data = []
+        st.session_state.bonds_df = pd.DataFrame(columns=COMPARISON_COLUMNS)
         st.session_state.advanced_mode = False
+        touch_bonds()
         st.rerun()
 
 # =============================================